@@ -1,84 +1,113 @@
 import torch
-from TTS.api import TTS
-import json
-from pydub import AudioSegment
+import torchaudio
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.models.xtts import Xtts
+from TTS.utils.manage import ModelManager
+import importlib.util
+import hashlib
+import contextlib
+import queue
+import threading
+import orjson
 from tqdm import tqdm
 import os
+import re
+import shutil
 import subprocess
+import multiprocessing
+import tempfile
 from pathlib import Path
-import pickle  # Add this import at the top with other imports
-import whisper
+import ctranslate2
+from faster_whisper import WhisperModel
+from faster_whisper.tokenizer import Tokenizer
 import numpy as np
-from difflib import SequenceMatcher
+from functools import lru_cache
+from rapidfuzz import fuzz
 
 # Choose CUDA if available
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using device: {device}")
 
+XTTS_MODEL = "tts_models/multilingual/multi-dataset/xtts_v2"
+# DeepSpeed is optional; it is only used on CUDA when installed
+USE_DEEPSPEED = device == "cuda" and importlib.util.find_spec("deepspeed") is not None
+COMPILE_GPT = device == "cuda"
+SPEAKER = "Damien Black"
+SPEAKER_WAV = None  # Optional reference sample to clone instead of the built-in speaker
+XTTS_SAMPLE_RATE = 24000
+WHISPER_MODEL = "base"
+# int8 weights through CTranslate2; activations stay in FP16 on the GPU
+WHISPER_COMPUTE_TYPE = "int8_float16" if device == "cuda" else "int8"
+WHISPER_BEAM_SIZE = 1  # Greedy decoding is accurate enough for a similarity check
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_WINDOW_SAMPLES = 30 * WHISPER_SAMPLE_RATE  # Whisper decodes fixed 30 second windows
+VERIFY_BATCH_SIZE = 16  # Chunks transcribed per Whisper decode
+SECONDS_PER_CHAR = 0.055  # Typical XTTS speaking rate, used to predict chunk duration
+MIN_RMS = 0.01  # Below this the take is treated as near-silent
+# You can adjust this threshold based on your needs
+SIMILARITY_THRESHOLD = 0.85
+MIN_SIMILARITY_THRESHOLD = 0.7  # Floor once the threshold is relaxed for proper nouns
+PLATEAU_MARGIN = 0.02  # Stop retrying once a take scores this much below the best one
+TTS_BATCH_SIZE = 8  # Chunks submitted to XTTS per batch
+MAX_ATTEMPTS = 3
+WARMUP_TEXT = "This sentence is only spoken to compile the model before the first chapter."
+PIPELINE_DEPTH = 4  # Generated batches allowed to wait for verification
+# Chapter worker processes, each with its own XTTS + Whisper. Workers are spread over the
+# visible GPUs; to run several on one GPU concurrently, start the CUDA MPS daemon
+# (nvidia-cuda-mps-control -d) first, otherwise they only time-slice.
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "1"))
+TTS_CACHE_DIR = Path(".tts_cache")  # Verified chunk audio, reused across runs
+
+_SENTENCE_RE = re.compile(r"[^.!?]+[.!?]+|[^.!?]+$")
+_CLAUSE_RE = re.compile(r"[^,;:]+[,;:]?")
+# Capitalized words or acronyms that don't start a sentence, i.e. likely names
+_PROPER_NOUN_RE = re.compile(r"(?<=[^\s.!?\"'])\s+([A-Z](?:[a-z][\w'-]*|[A-Z0-9]+))")
+
 def split_into_chunks(text, max_length=200):
     """
     Split text into smaller chunks while preserving sentence structure and respecting token limits.
     Max length reduced to 200 to stay well under the 400 token limit.
+    Sentences are packed greedily in one pass; a sentence that is too long on its own
+    falls back to its clauses, and a clause that is still too long falls back to words.
     """
-    # First split by periods, then clean up
-    sentences = [s.strip() + "." for s in text.split(".") if s.strip()]
     chunks = []
     current_chunk = ""
 
-    for sentence in sentences:
-        # Skip empty sentences
-        if not sentence.strip():
-            continue
-            
-        # If single sentence is too long, split by commas
-        if len(sentence) > max_length:
-            comma_parts = [p.strip() + "," for p in sentence.split(",") if p.strip()]
-            for part in comma_parts:
-                # If part is still too long, split by spaces
-                if len(part) > max_length:
-                    words = part.split()
-                    temp_chunk = ""
-                    for word in words:
-                        if len(temp_chunk) + len(word) + 1 <= max_length:
-                            temp_chunk += " " + word if temp_chunk else word
-                        else:
-                            chunks.append(temp_chunk.strip())
-                            temp_chunk = word
-                    if temp_chunk:
-                        chunks.append(temp_chunk.strip())
-                else:
-                    chunks.append(part)
-        # Try to combine sentences while respecting max_length
-        elif len(current_chunk) + len(sentence) + 1 <= max_length:
-            current_chunk += " " + sentence if current_chunk else sentence
+    def add(piece):
+        nonlocal current_chunk
+        if not current_chunk:
+            current_chunk = piece
+        elif len(current_chunk) + len(piece) + 1 <= max_length:
+            current_chunk += " " + piece
         else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = sentence
+            chunks.append(current_chunk)
+            current_chunk = piece
+
+    for sentence_match in _SENTENCE_RE.finditer(text):
+        sentence = sentence_match.group().strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_length:
+            add(sentence)
+            continue
+
+        # If single sentence is too long, split by clause punctuation
+        for clause_match in _CLAUSE_RE.finditer(sentence):
+            clause = clause_match.group().strip()
+            if not clause:
+                continue
+            if len(clause) <= max_length:
+                add(clause)
+            else:
+                # Clause is still too long, split by spaces
+                for word in clause.split():
+                    add(word)
 
     # Add the last chunk if it exists
     if current_chunk:
-        chunks.append(current_chunk.strip())
+        chunks.append(current_chunk)
 
-    # Final cleanup: ensure no chunk exceeds max_length
-    final_chunks = []
-    for chunk in chunks:
-        if len(chunk) <= max_length:
-            final_chunks.append(chunk)
-        else:
-            # Split oversized chunks
-            words = chunk.split()
-            temp_chunk = ""
-            for word in words:
-                if len(temp_chunk) + len(word) + 1 <= max_length:
-                    temp_chunk += " " + word if temp_chunk else word
-                else:
-                    final_chunks.append(temp_chunk.strip())
-                    temp_chunk = word
-            if temp_chunk:
-                final_chunks.append(temp_chunk.strip())
-
-    return final_chunks
+    return chunks
 
 def create_chapter_file(chapters_info, output_file):
     """Create a chapters metadata file for ffmpeg"""
@@ -93,125 +122,471 @@ def create_chapter_file(chapters_info, output_file):
             
             f.write(f"[CHAPTER]\nTIMEBASE=1/1\nSTART={start_time}\nEND={end_time}\ntitle={ch['title']}\n\n")
 
+def start_pcm_encoder(output_file):
+    """
+    Start an ffmpeg process that encodes raw 16-bit mono PCM read from stdin to AAC.
+    Chapters are written to its stdin as they finish, so the whole book never sits in memory.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(XTTS_SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "aac",
+        "-f", "ipod",
+        output_file
+    ]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+@lru_cache(maxsize=4096)
+def normalize_text(text):
+    """
+    Normalize text for comparison.
+    Cached, so a chunk's original text is only normalized once across retries.
+    """
+    return ' '.join(text.lower().split())
+
 def text_similarity(text1, text2):
     """
     Calculate similarity ratio between two texts after normalizing them.
     Returns float between 0 and 1, where 1 means identical texts.
     """
-    # Normalize texts for comparison
-    def normalize(text):
-        return ' '.join(text.lower().split())
-    
-    return SequenceMatcher(None, normalize(text1), normalize(text2)).ratio()
+    return fuzz.ratio(normalize_text(text1), normalize_text(text2)) / 100.0
 
-def verify_audio_quality(audio_file: str, original_text: str, whisper_model) -> bool:
+def transcribe_batch(audios, whisper_model: WhisperModel):
     """
-    Verify the quality of generated audio by converting it back to text
-    and comparing with the original.
-    Returns True if quality is acceptable, False otherwise.
+    Transcribe several short clips with a single batched Whisper decode.
+    Each clip is padded to its own 30 second window, so clips never bleed into each other.
+    Expects float32 waveforms at 16kHz, as produced by resample_for_whisper.
     """
-    # Transcribe the audio
-    result = whisper_model.transcribe(audio_file)
-    transcribed_text = result["text"]
-    
-    # Calculate similarity
-    similarity = text_similarity(original_text, transcribed_text)
-    
-    # You can adjust this threshold based on your needs
-    SIMILARITY_THRESHOLD = 0.85
-    return similarity >= SIMILARITY_THRESHOLD, similarity
+    tokenizer = Tokenizer(
+        whisper_model.hf_tokenizer,
+        whisper_model.model.is_multilingual,
+        task="transcribe",
+        language="en"
+    )
+    prompt = whisper_model.get_prompt(tokenizer, [], without_timestamps=True)
+
+    features = []
+    for audio in audios:
+        audio = audio[:WHISPER_WINDOW_SAMPLES]
+        audio = np.pad(audio, (0, WHISPER_WINDOW_SAMPLES - len(audio)))
+        mel = whisper_model.feature_extractor(audio)
+        features.append(mel[:, :whisper_model.feature_extractor.nb_max_frames])
+
+    results = whisper_model.model.generate(
+        ctranslate2.StorageView.from_array(np.stack(features).astype(np.float32)),
+        [prompt] * len(audios),
+        beam_size=WHISPER_BEAM_SIZE
+    )
+    return [tokenizer.decode(result.sequences_ids[0]) for result in results]
+
+def passes_quick_check(wav: np.ndarray, text: str) -> bool:
+    """
+    Cheap duration and energy check run before Whisper.
+    Returns True when the take is clearly fine: its length is close to what the
+    text predicts and it is not silent. Anything else still goes to Whisper.
+    """
+    duration = len(wav) / XTTS_SAMPLE_RATE
+    expected = SECONDS_PER_CHAR * len(text)
+    rms = np.sqrt(np.mean(np.square(wav))) if len(wav) else 0.0
+    return 0.7 * expected < duration < 1.5 * expected and rms > MIN_RMS
 
-def create_audiobook_from_pickle(pickle_path: str, output_file: str):
+def similarity_threshold(text: str) -> float:
     """
-    Reads chapters from pickle file, performs TTS on each chapter, 
-    and outputs an M4B file with embedded chapter markers.
+    Similarity a chunk's transcript must reach to be accepted.
+    Whisper often spells names differently from the book, which can cost at most
+    about the share of characters those names take up, so the threshold is lowered
+    by that share (down to MIN_SIMILARITY_THRESHOLD) instead of retrying forever.
     """
-    # Load pickle array
-    with open(pickle_path, "rb") as f:
-        chapters = pickle.load(f)
+    if not text:
+        return SIMILARITY_THRESHOLD
+    proper_noun_chars = sum(len(match.group(1)) for match in _PROPER_NOUN_RE.finditer(text))
+    return max(MIN_SIMILARITY_THRESHOLD, SIMILARITY_THRESHOLD - proper_noun_chars / len(text))
 
-    # Initialize TTS and Whisper models
-    tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-    whisper_model = whisper.load_model("base")
+def verify_audio_batch(audios, original_texts, whisper_model):
+    """
+    Verify the quality of generated audio by converting it back to text
+    and comparing with the original, for a whole batch of chunks at once.
+    Returns a list of (is_good_quality, similarity) tuples, one per chunk.
+    """
+    # Transcribe the audio
+    transcribed_texts = transcribe_batch(audios, whisper_model)
 
-    # Prepare empty AudioSegment
-    final_audio = AudioSegment.silent(duration=0)
+    verdicts = []
+    for original_text, transcribed_text in zip(original_texts, transcribed_texts):
+        # Calculate similarity
+        similarity = text_similarity(original_text, transcribed_text)
+        verdicts.append((similarity >= similarity_threshold(original_text), similarity))
+    return verdicts
 
-    # Track chapter information
-    chapters_info = []
-    current_offset = 0  # ms
+def load_xtts():
+    """
+    Load XTTS straight from its checkpoint so DeepSpeed and torch.compile can be enabled.
+    Returns the model and its config.
+    """
+    model_dir, _, _ = ModelManager().download_model(XTTS_MODEL)
+    config = XttsConfig()
+    config.load_json(os.path.join(model_dir, "config.json"))
+
+    xtts = Xtts.init_from_config(config)
+    xtts.load_checkpoint(config, checkpoint_dir=str(model_dir), use_deepspeed=USE_DEEPSPEED, eval=True)
+    xtts.to(device)
+
+    # DeepSpeed already swaps in fused kernels for the GPT, so only compile the eager model.
+    # The autoregressive decoder step runs thousands of times per chunk, and its KV cache
+    # grows by one position every step. Compiling with symbolic shapes gives one fused graph
+    # for every length, where static shapes would recompile (and "reduce-overhead" would
+    # record a new CUDA graph) for each new length.
+    if COMPILE_GPT and not USE_DEEPSPEED:
+        gpt_inference = xtts.gpt.gpt_inference
+        gpt_inference.forward = torch.compile(gpt_inference.forward, dynamic=True, fullgraph=False)
+
+    return xtts, config
+
+def load_speaker_latents(xtts):
+    """
+    Compute the XTTS speaker conditioning a single time and store it on the model,
+    so the speaker encoder never runs inside the chunk loop.
+    Clones SPEAKER_WAV when it is set, otherwise uses the built-in SPEAKER.
+    """
+    if SPEAKER_WAV:
+        gpt_cond_latent, speaker_embedding = xtts.get_conditioning_latents(audio_path=SPEAKER_WAV)
+    else:
+        speaker_latents = xtts.speaker_manager.speakers[SPEAKER]
+        gpt_cond_latent = speaker_latents["gpt_cond_latent"]
+        speaker_embedding = speaker_latents["speaker_embedding"]
+
+    xtts.gpt_cond_latent = gpt_cond_latent.to(device)
+    xtts.speaker_embedding = speaker_embedding.to(device)
+    return xtts.gpt_cond_latent, xtts.speaker_embedding
+
+def synthesize_batch(xtts, texts, gpt_cond_latent, speaker_embedding, **settings):
+    """
+    Run XTTS inference over a batch of text chunks that share one speaker conditioning.
+    Returns a list of float waveforms (numpy arrays at 24kHz), one per input text.
+    """
+    wavs = []
+    # FP16 autocast runs the matmuls on tensor cores; the CPU path stays in FP32
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=device != "cpu"):
+        for text in texts:
+            out = xtts.inference(
+                text,
+                "en",
+                gpt_cond_latent,
+                speaker_embedding,
+                enable_text_splitting=False,
+                **settings
+            )
+            wavs.append(np.asarray(out["wav"], dtype=np.float32))
+    return wavs
+
+# Built once so the sinc kernel is not recomputed for every chunk
+_whisper_resampler = torchaudio.transforms.Resample(XTTS_SAMPLE_RATE, WHISPER_SAMPLE_RATE)
+
+def resample_for_whisper(wav: np.ndarray) -> np.ndarray:
+    """Resample a 24kHz XTTS waveform to the 16kHz input Whisper expects."""
+    with torch.inference_mode():
+        return _whisper_resampler(torch.from_numpy(wav)).numpy()
+
+def to_pcm16(wav: np.ndarray) -> np.ndarray:
+    """Convert a float XTTS waveform to 16-bit PCM samples."""
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16)
+
+def cuda_stream():
+    """Run the calling thread's CUDA work on a dedicated stream (no-op on CPU)."""
+    if device != "cpu":
+        return torch.cuda.stream(torch.cuda.Stream(device=device))
+    return contextlib.nullcontext()
+
+def synthesize_chapter(text_chunks, xtts, whisper_model, gpt_cond_latent, speaker_embedding, settings):
+    """
+    Generate and verify every chunk of a chapter as a two-stage pipeline:
+    a producer thread runs XTTS on the next batch while this thread runs
+    batched Whisper verification on the batches already generated. Failed chunks are queued for
+    another attempt until MAX_ATTEMPTS is reached, or until a take scores clearly
+    worse than the best one so far, since further retries rarely recover then.
+    Returns two lists in the original chunk order: one waveform per chunk
+    (the best take, or None if generation never succeeded) and whether that
+    waveform passed verification.
+    """
+    jobs = queue.Queue()  # (chunk index, attempt) waiting for generation
+    generated = queue.Queue(maxsize=PIPELINE_DEPTH)  # (jobs, waveforms) waiting for verification
+    for i in range(len(text_chunks)):
+        jobs.put((i, 0))
+
+    def produce():
+        with cuda_stream():
+            stop = False
+            while not stop:
+                # Block for one job, then take whatever else is ready up to a full batch
+                batch = [jobs.get()]
+                while len(batch) < TTS_BATCH_SIZE and not jobs.empty():
+                    batch.append(jobs.get())
+                if None in batch:
+                    stop = True
+                    batch = [job for job in batch if job is not None]
+                if not batch:
+                    break
 
-    # Process chapters
-    for chapter in tqdm(chapters, desc="Chapters", unit="chapter"):
-        if not chapter["chapter_content"]:
-            continue
+                try:
+                    wavs = synthesize_batch(
+                        xtts,
+                        [text_chunks[i] for i, _ in batch],
+                        gpt_cond_latent,
+                        speaker_embedding,
+                        **settings
+                    )
+                except Exception as e:
+                    print(f"Error processing chunks {[i for i, _ in batch]}: {e}")
+                    wavs = [None] * len(batch)
+                generated.put((batch, wavs))
+
+    chunk_audio = [None] * len(text_chunks)
+    accepted = [False] * len(text_chunks)
+    best_similarity = [-1.0] * len(text_chunks)
+    remaining = len(text_chunks)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    with tqdm(total=len(text_chunks), desc="Chunks", leave=False) as progress:
+        while remaining:
+            # Wait for one generated batch, then verify whatever else is already waiting with it
+            ready = [generated.get()]
+            while sum(len(batch) for batch, _ in ready) < VERIFY_BATCH_SIZE and not generated.empty():
+                ready.append(generated.get())
+            takes = [(job, wav) for batch, wavs in ready for job, wav in zip(batch, wavs)]
+
+            # Only takes the duration/energy check can't vouch for go through Whisper
+            verdicts = {}
+            verified = []
+            for job, wav in takes:
+                if wav is None:
+                    continue
+                if passes_quick_check(wav, text_chunks[job[0]]):
+                    verdicts[job] = (True, None)
+                else:
+                    verified.append((job, wav))
 
-        chapter_text = " ".join(chapter["chapter_content"]).strip()
-        if not chapter_text:
-            continue
+            if verified:
+                try:
+                    # Verify the audio quality
+                    results = verify_audio_batch(
+                        [resample_for_whisper(wav) for _, wav in verified],
+                        [text_chunks[i] for (i, _), _ in verified],
+                        whisper_model
+                    )
+                    verdicts.update(zip([job for job, _ in verified], results))
+                except Exception as e:
+                    print(f"Error verifying chunks {[i for (i, _), _ in verified]}: {e}")
+
+            for (i, attempt), wav in takes:
+                # Similarity is None when generation or verification errored out
+                is_good_quality, similarity = verdicts.get((i, attempt), (False, None))
+                if is_good_quality:
+                    chunk_audio[i] = wav
+                    accepted[i] = True
+                    if similarity is None:
+                        print(f"Chunk {i} generated successfully (passed duration/energy check)")
+                    else:
+                        print(f"Chunk {i} generated successfully (similarity: {similarity:.2f})")
+                    remaining -= 1
+                    progress.update(1)
+                    continue
+
+                # Keep the best take so far so there is always a fallback
+                improved = similarity is not None and similarity > best_similarity[i]
+                plateaued = similarity is not None and similarity < best_similarity[i] - PLATEAU_MARGIN
+                if wav is not None and (chunk_audio[i] is None or improved):
+                    chunk_audio[i] = wav
+                if improved:
+                    best_similarity[i] = similarity
+
+                if plateaued:
+                    print(f"Warning: Chunk {i} stopped improving after {attempt + 1} attempts, "
+                          f"keeping best take (similarity: {best_similarity[i]:.2f})")
+                elif attempt + 1 < MAX_ATTEMPTS:
+                    similarity_text = "n/a" if similarity is None else f"{similarity:.2f}"
+                    print(f"Chunk {i} attempt {attempt + 1} failed (similarity: {similarity_text})")
+                    jobs.put((i, attempt + 1))
+                    continue
+                else:
+                    print(f"Warning: Failed to generate good quality audio for chunk {i} after {MAX_ATTEMPTS} attempts")
 
-        chapter_start = current_offset
-        text_chunks = split_into_chunks(chapter_text, max_length=250)
-        chapter_audio = AudioSegment.silent(duration=0)
+                remaining -= 1
+                progress.update(1)
 
-        for i, chunk in enumerate(tqdm(text_chunks, desc="Chunks", leave=False)):
-            max_attempts = 3
-            attempt = 0
-            chunk_generated = False
+    jobs.put(None)
+    producer.join()
+    return chunk_audio, accepted
 
-            while attempt < max_attempts and not chunk_generated:
-                temp_wav = f"temp_{chapter['chapter_title']}_{i}_attempt_{attempt}.wav"
+def load_models():
+    """
+    Load everything needed to voice chapters on the current device.
+    Returns (xtts, whisper_model, gpt_cond_latent, speaker_embedding, settings),
+    in the order synthesize_chapter takes them after the text chunks.
+    """
+    xtts, config = load_xtts()
+
+    whisper_device, _, whisper_index = device.partition(":")
+    whisper_model = WhisperModel(
+        WHISPER_MODEL,
+        device=whisper_device,
+        device_index=int(whisper_index or 0),
+        compute_type=WHISPER_COMPUTE_TYPE
+    )
+
+    # Sampling settings XTTS would otherwise read from its config on every call
+    settings = {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+    gpt_cond_latent, speaker_embedding = load_speaker_latents(xtts)
+
+    if COMPILE_GPT and not USE_DEEPSPEED:
+        # Pay the one-off compile cost here rather than inside the first chapter's pipeline
+        synthesize_batch(xtts, [WARMUP_TEXT], gpt_cond_latent, speaker_embedding, **settings)
+
+    return xtts, whisper_model, gpt_cond_latent, speaker_embedding, settings
+
+def chunk_cache_path(text: str) -> Path:
+    """Path of the cached PCM for a chunk, keyed by its text, voice and language."""
+    speaker = SPEAKER_WAV or SPEAKER
+    key = hashlib.blake2b(f"{text}|{speaker}|en".encode("utf-8"), digest_size=16).hexdigest()
+    return TTS_CACHE_DIR / f"{key}.pcm"
+
+def voice_chapter(chapter_text, models) -> bytearray:
+    """
+    Split a chapter into chunks, voice them and return the chapter as 16-bit PCM bytes.
+    Chunks already in the cache skip TTS and verification entirely; only verified
+    takes are cached, so a chunk that kept failing is tried again on the next run.
+    """
+    text_chunks = split_into_chunks(chapter_text, max_length=250)
+    cache_paths = [chunk_cache_path(chunk) for chunk in text_chunks]
+    pcm_chunks = [np.fromfile(path, dtype=np.int16) if path.exists() else None for path in cache_paths]
 
-                try:
-                    # Generate audio from text
-                    tts.tts_to_file(
-                        text=chunk,
-                        file_path=temp_wav,
-                        speaker="Damien Black",
-                        language="en",
-                        split_sentences=False
-                    )
+    missing = [i for i, pcm in enumerate(pcm_chunks) if pcm is None]
+    chunk_audio, accepted = synthesize_chapter([text_chunks[i] for i in missing], *models)
 
-                    # Verify the audio quality
-                    is_good_quality, similarity = verify_audio_quality(temp_wav, chunk, whisper_model)
+    TTS_CACHE_DIR.mkdir(exist_ok=True)
+    for i, wav, is_accepted in zip(missing, chunk_audio, accepted):
+        # Failed chunks still carry their last take as fallback
+        if wav is None:
+            continue
+        pcm_chunks[i] = to_pcm16(wav)
+        if is_accepted:
+            # Write then rename, so another worker never reads a half-written file
+            temp_path = cache_paths[i].with_suffix(f".{os.getpid()}.tmp")
+            pcm_chunks[i].tofile(temp_path)
+            os.replace(temp_path, cache_paths[i])
+
+    # Copy every chunk once into a buffer sized for the whole chapter
+    pcm_chunks = [pcm for pcm in pcm_chunks if pcm is not None]
+    chapter_pcm = bytearray(sum(pcm.nbytes for pcm in pcm_chunks))
+    offset = 0
+    for pcm in pcm_chunks:
+        chapter_pcm[offset:offset + pcm.nbytes] = memoryview(pcm).cast("B")
+        offset += pcm.nbytes
+    return chapter_pcm
+
+_worker_models = None
+
+def init_worker(gpu_indices):
+    """Pool initializer: pin this worker to one GPU and load its own copy of the models."""
+    global device, _worker_models
+    if device == "cuda":
+        gpu_index = gpu_indices.get()
+        device = f"cuda:{gpu_index}"
+        torch.cuda.set_device(gpu_index)
+    _worker_models = load_models()
+
+def voice_chapter_to_file(task):
+    """
+    Pool task: voice one chapter with this worker's models.
+    Writes the PCM to a file in pcm_dir and returns its path, so the audio
+    does not have to be pickled back to the main process.
+    """
+    index, chapter_text, pcm_dir = task
+    pcm_path = os.path.join(pcm_dir, f"chapter_{index}.pcm")
+    with open(pcm_path, "wb") as f:
+        f.write(voice_chapter(chapter_text, _worker_models))
+    return pcm_path
 
-                    if is_good_quality:
-                        chunk_audio = AudioSegment.from_wav(temp_wav)
-                        chapter_audio += chunk_audio
-                        chunk_generated = True
-                        print(f"Chunk {i} generated successfully (similarity: {similarity:.2f})")
-                    else:
-                        print(f"Chunk {i} attempt {attempt + 1} failed (similarity: {similarity:.2f})")
-                        attempt += 1
+def voice_chapters(chapter_texts, pcm_dir):
+    """
+    Yield the 16-bit PCM bytes of each chapter, in order.
+    With TTS_WORKERS > 1 the chapters are voiced in parallel by worker processes;
+    otherwise they are voiced one after another in this process.
+    """
+    if TTS_WORKERS <= 1:
+        models = load_models()
+        for chapter_text in chapter_texts:
+            yield voice_chapter(chapter_text, models)
+        return
+
+    # CUDA can't be initialized in forked children, so workers are spawned
+    context = multiprocessing.get_context("spawn")
+    gpu_indices = context.Queue()
+    for worker in range(TTS_WORKERS):
+        gpu_indices.put(worker % max(torch.cuda.device_count(), 1))
+
+    tasks = [(i, chapter_text, pcm_dir) for i, chapter_text in enumerate(chapter_texts)]
+    with context.Pool(TTS_WORKERS, initializer=init_worker, initargs=(gpu_indices,)) as pool:
+        # imap hands results back in chapter order while later chapters are still being voiced
+        for pcm_path in pool.imap(voice_chapter_to_file, tasks):
+            with open(pcm_path, "rb") as f:
+                pcm_bytes = f.read()
+            os.remove(pcm_path)
+            yield pcm_bytes
+
+def create_audiobook_from_json(json_path: str, output_file: str):
+    """
+    Reads chapters from a JSON file, performs TTS on each chapter, 
+    and outputs an M4B file with embedded chapter markers.
+    """
+    # Load chapter array
+    with open(json_path, "rb") as f:
+        chapters = orjson.loads(f.read())
+
+    # Only chapters with text are sent off to be voiced
+    chapter_titles = []
+    chapter_texts = []
+    for chapter in chapters:
+        chapter_text = " ".join(chapter["chapter_content"]).strip()
+        if chapter_text:
+            chapter_titles.append(chapter["chapter_title"])
+            chapter_texts.append(chapter_text)
 
-                except Exception as e:
-                    print(f"Error processing chunk {i}: {e}")
-                    attempt += 1
-                finally:
-                    if os.path.exists(temp_wav):
-                        os.remove(temp_wav)
+    # Track chapter information
+    chapters_info = []
+    current_offset = 0  # samples
 
-            if not chunk_generated:
-                print(f"Warning: Failed to generate good quality audio for chunk after {max_attempts} attempts")
-                # Use the last generated audio as fallback
-                chunk_audio = AudioSegment.from_wav(temp_wav)
-                chapter_audio += chunk_audio
+    # Stream each finished chapter straight into the AAC encoder
+    temp_audio = "temp_audiobook.m4a"
+    encoder = start_pcm_encoder(temp_audio)
+    pcm_dir = tempfile.mkdtemp(prefix="chapters_")
+    chapter_pcms = voice_chapters(chapter_texts, pcm_dir)
 
-        final_audio += chapter_audio
-        chapter_end = current_offset + len(chapter_audio)
+    try:
+        # Process chapters
+        progress = tqdm(zip(chapter_titles, chapter_pcms), total=len(chapter_titles), desc="Chapters", unit="chapter")
+        for chapter_title, pcm_bytes in progress:
+            chapter_start = current_offset
+            encoder.stdin.write(pcm_bytes)
+            chapter_end = current_offset + len(pcm_bytes) // 2
 
-        chapters_info.append({
-            "start_ms": chapter_start,
-            "end_ms": chapter_end,
-            "title": chapter["chapter_title"]
-        })
+            chapters_info.append({
+                "start_ms": chapter_start * 1000 // XTTS_SAMPLE_RATE,
+                "end_ms": chapter_end * 1000 // XTTS_SAMPLE_RATE,
+                "title": chapter_title
+            })
 
-        current_offset = chapter_end
+            current_offset = chapter_end
 
-    try:
-        # Export as temporary audio file
-        temp_audio = "temp_audiobook.m4a"
-        final_audio.export(temp_audio, format="ipod", codec="aac")
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise subprocess.CalledProcessError(encoder.returncode, encoder.args)
 
         # Create chapter metadata file
         create_chapter_file(chapters_info, "chapters.txt")
@@ -236,26 +611,31 @@ def create_audiobook_from_pickle(pickle_path: str, output_file: str):
         print(f"Error creating audiobook: {e}")
         raise
     finally:
-        # Clean up temporary files
+        # Stop any chapter workers, then clean up temporary files
+        chapter_pcms.close()
+        if encoder.poll() is None:
+            encoder.kill()
+            encoder.wait()
         if os.path.exists(temp_audio):
             os.remove(temp_audio)
+        shutil.rmtree(pcm_dir, ignore_errors=True)
         if os.path.exists("chapters.txt"):
             os.remove("chapters.txt")
 
 def main():
-    # Define the input directory where pickle files are located
-    input_dir = "pickle_files"  # Changed from json_files
+    # Define the input directory where chapter JSON files are located
+    input_dir = "json_files"
     
     # Create output directory if it doesn't exist
     output_dir = "audiobooks"
     os.makedirs(output_dir, exist_ok=True)
     
-    # Get all pickle files in the input directory
-    pickle_files = list(Path(input_dir).glob("*.pkl"))
+    # Get all JSON files in the input directory
+    json_files = list(Path(input_dir).glob("*.json"))
     
-    for pickle_file in pickle_files:
+    for json_file in json_files:
         # Create output filename with .m4b extension
-        output_filename = pickle_file.stem + ".m4b"
+        output_filename = json_file.stem + ".m4b"
         output_path = os.path.join(output_dir, output_filename)
         
         # Skip if file already exists
@@ -263,12 +643,12 @@ def main():
             print(f"Skipping {output_filename} - file already exists")
             continue
         
-        print(f"\nProcessing {pickle_file.name}...")
+        print(f"\nProcessing {json_file.name}...")
         try:
-            create_audiobook_from_pickle(str(pickle_file), output_path)
+            create_audiobook_from_json(str(json_file), output_path)
             print(f"Successfully created {output_filename}")
         except Exception as e:
-            print(f"Error processing {pickle_file.name}: {e}")
+            print(f"Error processing {json_file.name}: {e}")
             continue
 
 if __name__ == "__main__":
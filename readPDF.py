@@ -1,33 +1,55 @@
 import sys
+import os
 import re
+import multiprocessing
 from collections import OrderedDict
-import json
-import pickle
+import orjson
 
-import PyPDF2
+import pypdfium2 as pdfium
 import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup
 
+_CHAPTER_RE = re.compile(r"\s*chapter", re.IGNORECASE)
+_PAGE_NUMBER_RE = re.compile(r"\s*\d+\s*")
+
 def is_chapter_header(line: str) -> bool:
     """
     Simple heuristic to decide if a line looks like a chapter header.
     Adjust this logic to better match your PDF structure.
     """
-    line_stripped = line.strip()
     # Condition 1: The line starts with the word "Chapter" or "CHAPTER".
+    if _CHAPTER_RE.match(line):
+        return True
     # Condition 2: The line is in all uppercase and longer than a few characters.
-    return (
-        line_stripped.lower().startswith("chapter")
-        or (line_stripped == line_stripped.upper() and len(line_stripped) > 4)
-    )
+    # The length test is cheap, so it runs before building the upper-cased copy.
+    line_stripped = line.strip()
+    return len(line_stripped) > 4 and line_stripped == line_stripped.upper()
 
 def is_page_number(line: str) -> bool:
     """
     A naive check to see if the line is purely a digit (likely a page number).
     """
-    line_stripped = line.strip()
-    return line_stripped.isdigit()
+    return _PAGE_NUMBER_RE.fullmatch(line) is not None
+
+def _extract_pages(args) -> list:
+    """
+    Extract the text of pages [start, stop) of a PDF.
+    Runs in a worker process, so it opens its own document (PDFium handles can't be pickled).
+    """
+    pdf_path, start, stop = args
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        texts = []
+        for page_index in range(start, stop):
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
 
 def parse_pdf(pdf_path: str) -> OrderedDict:
     """
@@ -35,30 +57,38 @@ def parse_pdf(pdf_path: str) -> OrderedDict:
       keys   -> Chapter (or section) title
       values -> List of text lines in that section.
     """
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        chapter_data = OrderedDict()
+    pdf = pdfium.PdfDocument(pdf_path)
+    page_count = len(pdf)
+    pdf.close()
 
-        current_chapter = "Introduction"
-        chapter_data[current_chapter] = []
+    # Extract contiguous page ranges in parallel; pool.map keeps them in page order
+    workers = min(os.cpu_count() or 1, page_count) or 1
+    step = max(1, -(-page_count // workers))
+    ranges = [(pdf_path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with multiprocessing.Pool(workers) as pool:
+        texts = [text for page_texts in pool.map(_extract_pages, ranges) for text in page_texts]
 
-        for page_index in range(len(reader.pages)):
-            text = reader.pages[page_index].extract_text()
-            if not text:
-                continue
+    chapter_data = OrderedDict()
 
-            for line in text.splitlines():
-                # Remove page numbers if detected
-                if is_page_number(line):
-                    continue
+    current_chapter = "Introduction"
+    chapter_data[current_chapter] = []
 
-                if is_chapter_header(line):
-                    # Start a new chapter section
-                    current_chapter = line.strip()
-                    chapter_data[current_chapter] = []
-                else:
-                    # Append this line to the current chapter
-                    chapter_data[current_chapter].append(line)
+    for text in texts:
+        if not text:
+            continue
+
+        for line in text.splitlines():
+            # Remove page numbers if detected
+            if is_page_number(line):
+                continue
+
+            if is_chapter_header(line):
+                # Start a new chapter section
+                current_chapter = line.strip()
+                chapter_data[current_chapter] = []
+            else:
+                # Append this line to the current chapter
+                chapter_data[current_chapter].append(line)
 
     return chapter_data
 
@@ -83,6 +113,44 @@ def parse_text_file(text_path: str) -> OrderedDict:
                 chapter_data[current_chapter].append(line)
     return chapter_data
 
+def _parse_epub_document(content: bytes) -> list:
+    """
+    Parse one EPUB document in a worker process.
+    Returns a list of (chapter_title, lines) sections in document order, where a
+    title of None means the lines continue whichever chapter came before.
+    """
+    # Parse HTML content
+    soup = BeautifulSoup(content, 'html.parser')
+    sections = []
+
+    # Check for common chapter heading patterns
+    for heading in soup.find_all(['h1', 'h2', 'h3']):
+        heading_text = heading.get_text(strip=True)
+        if is_chapter_header(heading_text):
+            # Get the content following this heading until the next heading
+            content_lines = []
+            for elem in heading.find_next_siblings():
+                if elem.name in ['h1', 'h2', 'h3']:
+                    break
+                if elem.get_text(strip=True):
+                    content_lines.extend(line.strip() for line in elem.get_text().splitlines() if line.strip())
+            sections.append((heading_text, content_lines))
+
+    # If no chapter heading was found, check if the content itself indicates a chapter
+    if not sections:
+        text_content = soup.get_text(strip=True)
+        lines = [line.strip() for line in text_content.splitlines() if line.strip()]
+
+        for line in lines:
+            if is_chapter_header(line):
+                sections.append((line, []))
+            elif sections:
+                sections[-1][1].append(line)
+            else:
+                sections.append((None, [line]))
+
+    return sections
+
 def parse_epub(epub_path: str) -> OrderedDict:
     """
     Parse an EPUB file and return an OrderedDict where:
@@ -90,47 +158,22 @@ def parse_epub(epub_path: str) -> OrderedDict:
         values -> List of text lines in that section.
     """
     book = epub.read_epub(epub_path)
+    documents = [item.get_content() for item in book.get_items() if item.get_type() == ebooklib.ITEM_DOCUMENT]
+
+    # Parse the HTML documents in parallel, then stitch the sections together in order
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        parsed_documents = pool.map(_parse_epub_document, documents)
+
     chapter_data = OrderedDict()
     current_chapter = "Introduction"
     chapter_data[current_chapter] = []
 
-    for item in book.get_items():
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            # Parse HTML content
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
-            
-            # Look for chapter indicators in the document
-            chapter_found = False
-            
-            # Check for common chapter heading patterns
-            for heading in soup.find_all(['h1', 'h2', 'h3']):
-                heading_text = heading.get_text(strip=True)
-                if is_chapter_header(heading_text):
-                    current_chapter = heading_text
-                    chapter_data[current_chapter] = []
-                    chapter_found = True
-                    
-                    # Get the content following this heading until the next heading
-                    content = []
-                    for elem in heading.find_next_siblings():
-                        if elem.name in ['h1', 'h2', 'h3']:
-                            break
-                        if elem.get_text(strip=True):
-                            content.extend(line.strip() for line in elem.get_text().splitlines() if line.strip())
-                    chapter_data[current_chapter].extend(content)
-            
-            # If no chapter heading was found, check if the content itself indicates a chapter
-            if not chapter_found:
-                text_content = soup.get_text(strip=True)
-                lines = [line.strip() for line in text_content.splitlines() if line.strip()]
-                
-                for line in lines:
-                    if is_chapter_header(line):
-                        current_chapter = line
-                        chapter_data[current_chapter] = []
-                        chapter_found = True
-                    else:
-                        chapter_data[current_chapter].append(line)
+    for sections in parsed_documents:
+        for chapter_title, lines in sections:
+            if chapter_title is not None:
+                current_chapter = chapter_title
+                chapter_data[current_chapter] = []
+            chapter_data[current_chapter].extend(lines)
 
     # Clean up empty chapters
     return OrderedDict((k, v) for k, v in chapter_data.items() if v)
@@ -157,10 +200,9 @@ def main():
             "chapter_content": lines
         })
 
-    # Write out the data to a pickle file instead of JSON
-    output_path = output_path.replace('.json', '.pkl')  # Change extension
-    with open(output_path, "wb") as outfile:  # Note: "wb" for binary write
-        pickle.dump(structured_array, outfile)
+    # Write out the data as JSON (orjson writes UTF-8 bytes, hence "wb")
+    with open(output_path, "wb") as outfile:
+        outfile.write(orjson.dumps(structured_array))
 
     # Print the extracted structure
     for chapter_title, lines in structured_text.items():